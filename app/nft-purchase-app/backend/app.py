@@ -1,7 +1,15 @@
 # nft-purchase-app/backend/app.py
 import os
+import hashlib
+import math
 import json  # Import json
+import threading
+from decimal import Decimal
+import base58
+import orjson
+from cachetools import TTLCache
 from flask import Flask, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from solana.rpc.api import Client
 from solana.keypair import Keypair
@@ -9,29 +17,342 @@ from solana.transaction import Transaction
 from solana.system_program import SystemProgram
 from solana.publickey import PublicKey
 from dotenv import load_dotenv
-from datetime import datetime
-from sqlalchemy import event
-from sqlalchemy.engine import Engine
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlite3 import dbapi2 as sqlite
 
 # Import utility functions
-from .utils import generate_nft, send_email
+from .utils import generate_nft, send_email_async
 
 load_dotenv()
 
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for jsonify() and request.get_json()."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Database Configuration
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", "sqlite:///:memory:")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
-# SQLite foreign key enforcement (for SQLite DBs)
-if "sqlite" in app.config["SQLALCHEMY_DATABASE_URI"]:
+# File-backed SQLite runs in WAL mode with one writer connection and a
+# separate read pool, so reads are not serialized behind writes.
+_database_url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+SQLITE_DB = _database_url.get_backend_name() == "sqlite"
+SQLITE_MEMORY_DB = SQLITE_DB and _database_url.database in (None, "", ":memory:")
+SQLITE_FILE_DB = SQLITE_DB and not SQLITE_MEMORY_DB
+
+# Connection pooling: keep connections open across requests instead of
+# reopening the database (and replaying the pragmas) on every request.
+if SQLITE_MEMORY_DB:
+    # Every new connection would be a fresh empty database, so share one.
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+elif SQLITE_FILE_DB:
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"poolclass": QueuePool, "pool_size": 1, "max_overflow": 0, "connect_args": {"check_same_thread": False}}
+else:
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"poolclass": QueuePool, "pool_size": 6, "max_overflow": 10, "pool_pre_ping": True, "pool_recycle": 300}
+
+# SQLite pragmas: WAL journaling, relaxed fsync, lock wait and foreign key enforcement (for SQLite DBs)
+if SQLITE_DB:
     @event.listens_for(Engine, "connect")
     def _set_sqlite_pragma(dbapi_connection, connection_record):
         if isinstance(dbapi_connection, sqlite.Connection):
             cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL;")
+            cursor.execute("PRAGMA synchronous=NORMAL;")
+            cursor.execute("PRAGMA busy_timeout=30000;")
+            cursor.execute("PRAGMA cache_size=-1000000;")
             cursor.execute("PRAGMA foreign_keys=ON;")
             cursor.close()
 
-db = SQLAlchemy(app
\ No newline at end of file
+db = SQLAlchemy(app)
+
+if SQLITE_FILE_DB:
+    with app.app_context():
+        write_engine = db.engine
+
+    # Built from the engine's URL, not the config string: Flask-SQLAlchemy
+    # resolves relative SQLite paths against the instance folder.
+    read_engine = create_engine(write_engine.url, poolclass=QueuePool, pool_size=8, max_overflow=10, connect_args={"check_same_thread": False})
+    read_session = scoped_session(sessionmaker(bind=read_engine))
+
+    # Take the write lock up front (BEGIN IMMEDIATE) instead of upgrading a
+    # read lock mid-transaction, which is what produces "database is locked".
+    @event.listens_for(write_engine, "connect")
+    def _disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(write_engine, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    @app.teardown_appcontext
+    def _remove_read_session(exception=None):
+        read_session.remove()
+else:
+    read_session = db.session
+
+# Solana Configuration
+SOLANA_RPC_URL = os.getenv("SOLANA_RPC_URL", "https://api.devnet.solana.com")
+CRAFT_TOKEN_MINT_ADDRESS = os.getenv("CRAFT_TOKEN_MINT_ADDRESS")
+ADMIN_WALLET_PRIVATE_KEY = os.getenv("ADMIN_WALLET_PRIVATE_KEY")
+ADMIN_WALLET_PUBLIC_KEY = os.getenv("ADMIN_WALLET_PUBLIC_KEY")
+# Price of one NFT in CRAFT; payments are checked against this, not the request.
+NFT_PRICE_CRAFT = Decimal(os.getenv("NFT_PRICE_CRAFT", "1"))
+
+solana_client = Client(SOLANA_RPC_URL)
+
+# Per-signature cache of getTransaction responses. A landed transaction never
+# changes, so repeat verifications of the same signature skip the RPC call.
+_transaction_cache = TTLCache(maxsize=10_000, ttl=30)
+_transaction_cache_lock = threading.Lock()
+
+# Load Admin Keypair - Securely (JSON byte list or base58 string, never eval)
+admin_keypair = None  # Initialize to None
+if ADMIN_WALLET_PRIVATE_KEY:
+    try:
+        if ADMIN_WALLET_PRIVATE_KEY.lstrip().startswith("["):
+            secret_key = bytes(json.loads(ADMIN_WALLET_PRIVATE_KEY))
+        else:
+            secret_key = base58.b58decode(ADMIN_WALLET_PRIVATE_KEY.strip())
+        admin_keypair = Keypair.from_secret_key(secret_key)
+    except json.JSONDecodeError as e:
+        print(f"Error decoding ADMIN_WALLET_PRIVATE_KEY: {e}.  Make sure it's a valid JSON list or base58 string.")
+    except Exception as e:
+        print(f"Error loading admin keypair: {e}")
+
+    # Validation check.  If admin_keypair did not load from the environment variable, set to None
+    if not admin_keypair:
+        print("Admin Keypair could not be loaded.  Admin priviledges unavailable")
+
+else:
+    print("ADMIN_WALLET_PRIVATE_KEY not set. Admin functions will be disabled.")
+
+# Compiled once at startup; .html templates are autoescaped by Flask.
+email_template = app.jinja_env.get_template("nft_email.html")
+
+# Database Models
+class TransactionHistory(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(db.String(255), nullable=False, unique=True)
+    user_public_key = db.Column(db.String(255), nullable=False, index=True)
+    nft_id = db.Column(db.String(255), db.ForeignKey("nft.nft_id"), nullable=False)
+    timestamp = db.Column(db.DateTime(timezone=True), default=func.now(), server_default=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"<Transaction {self.transaction_id}>"
+
+
+class NFT(db.Model):
+    nft_id = db.Column(db.String(255), primary_key=True)
+    metadata_url = db.Column(db.String(255))
+    owner_public_key = db.Column(db.String(255), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<NFT {self.nft_id}>"
+
+
+with app.app_context():
+    db.create_all()
+    # create_all() skips tables that already exist; add any missing indexes too.
+    for index in NFT.__table__.indexes | TransactionHistory.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+
+def get_transaction(transaction_signature):
+    with _transaction_cache_lock:
+        cached = _transaction_cache.get(transaction_signature)
+    if cached is not None:
+        return cached
+
+    # jsonParsed returns SPL token instructions already decoded; "confirmed"
+    # avoids waiting for finalization and version 0 admits versioned txs.
+    transaction_data = solana_client.get_transaction(transaction_signature, encoding="jsonParsed", commitment="confirmed", max_supported_transaction_version=0)
+
+    # Only cache transactions that were found; a miss may land a moment later.
+    if transaction_data and transaction_data.get("result") is not None:
+        with _transaction_cache_lock:
+            _transaction_cache[transaction_signature] = transaction_data
+    return transaction_data
+
+
+# Transaction Verification Function
+def verify_transaction(transaction_signature, user_public_key, amount, craft_token_mint_address, admin_wallet_public_key):
+    try:
+        transaction_data = get_transaction(transaction_signature)
+
+        # Robust Error Checking
+        if not transaction_data or transaction_data.get("result") is None or transaction_data["result"].get("meta") is None or transaction_data["result"]["meta"].get("err") is not None:
+            return False, "Transaction failed or not found on Solana"
+
+        transaction = transaction_data["result"].get("transaction")  # Use .get() for safety
+        if not transaction:
+            return False, "Transaction data missing"
+
+        message = transaction.get("message")  # Use .get() for safety
+        if not message:
+            return False, "Transaction message missing"
+
+        instructions = message.get("instructions")  # Use .get() for safety
+        if not instructions:
+            return False, "Transaction instructions missing"
+
+        required_amount = Decimal(str(amount))
+        if not required_amount > 0:
+            return False, "Invalid amount"
+
+        # source/destination are token accounts, not wallets: the destination's
+        # owner and mint come from the token balances recorded for the accounts.
+        token_accounts = {}
+        account_keys = message.get("accountKeys", [])
+        for balance in transaction_data["result"]["meta"].get("postTokenBalances") or []:
+            try:
+                account_key = account_keys[balance["accountIndex"]]
+            except (KeyError, IndexError):
+                continue
+            pubkey = account_key.get("pubkey") if isinstance(account_key, dict) else account_key
+            token_accounts[pubkey] = balance
+
+        transfer_instruction_found = False
+        for instruction in instructions:
+            if not isinstance(instruction, dict):
+                continue  # Skip if instruction is not a dictionary
+
+            parsed = instruction.get("parsed")
+            if instruction.get("program") != "spl-token" or not isinstance(parsed, dict):
+                continue
+            if parsed.get("type") not in ("transfer", "transferChecked"):
+                continue
+
+            info = parsed.get("info") or {}
+            if (info.get("authority") or info.get("multisigAuthority")) != user_public_key:
+                continue
+
+            destination = token_accounts.get(info.get("destination"))
+            if not destination or destination.get("owner") != admin_wallet_public_key or destination.get("mint") != craft_token_mint_address:
+                continue
+            if info.get("mint", craft_token_mint_address) != craft_token_mint_address:
+                continue
+
+            # Raw base-unit amount: "tokenAmount" for transferChecked, "amount" for transfer.
+            token_amount = info.get("tokenAmount")
+            if isinstance(token_amount, dict):
+                raw_amount, decimals = token_amount.get("amount"), token_amount.get("decimals")
+            else:
+                raw_amount, decimals = info.get("amount"), (destination.get("uiTokenAmount") or {}).get("decimals")
+            if raw_amount is None or decimals is None:
+                continue
+            if Decimal(raw_amount) < required_amount.scaleb(decimals):
+                continue
+
+            transfer_instruction_found = True
+            break
+
+        if not transfer_instruction_found:
+            return False, "Invalid transaction: No transfer to the recipient found."
+
+        return True, None
+
+    except Exception as e:
+        print(f"Error verifying transaction: {e}")
+        return False, f"Error during verification: {str(e)}"
+
+
+# API Endpoint for Payment Verification
+@app.route("/verify_payment", methods=["POST"])
+def verify_payment():
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON data"}), 400
+
+    transaction_signature = data.get("transactionSignature")
+    user_public_key = data.get("userPublicKey")
+    amount = data.get("amount")  # Amount should be passed as a number in json
+    craft_token_mint_address = data.get("craftTokenMintAddress")
+
+    if not all([transaction_signature, user_public_key, amount, craft_token_mint_address]):
+        return jsonify({"error": "Missing parameters"}), 400
+
+    try:
+        amount = float(amount)  # Try to convert to float (Defensive programming)
+    except ValueError:
+        return jsonify({"error": "Invalid amount format"}), 400
+
+    if not admin_keypair:
+        return jsonify({"success": False, "error": "Admin wallet not properly configured"}), 500
+    if not CRAFT_TOKEN_MINT_ADDRESS or not ADMIN_WALLET_PUBLIC_KEY:
+        return jsonify({"success": False, "error": "CRAFT token not properly configured"}), 500
+
+    # The client's mint and amount only have to agree with the configured
+    # values; verification below uses the server-side ones.
+    if craft_token_mint_address != CRAFT_TOKEN_MINT_ADDRESS:
+        return jsonify({"error": "Unsupported token mint"}), 400
+    if not math.isfinite(amount) or Decimal(str(amount)) != NFT_PRICE_CRAFT:
+        return jsonify({"error": "Amount does not match the NFT price"}), 400
+
+    # Replay protection: a signature already on record has minted its NFT.
+    # This is a probe on the unique transaction_id index and skips the RPC call.
+    if read_session.query(TransactionHistory.id).filter_by(transaction_id=transaction_signature).first():
+        return jsonify({"success": False, "error": "Transaction already processed"}), 409
+
+    is_valid, error_message = verify_transaction(transaction_signature, user_public_key, NFT_PRICE_CRAFT, CRAFT_TOKEN_MINT_ADDRESS, ADMIN_WALLET_PUBLIC_KEY)
+
+    if is_valid:
+        nft_data = generate_nft(user_public_key, transaction_signature)
+        if not nft_data:
+            return jsonify({"success": False, "error": "NFT generation failed"}), 500
+
+        nft = NFT(nft_id=nft_data["nft_id"], metadata_url=nft_data.get("metadata_url", ""), owner_public_key=user_public_key)
+        new_transaction = TransactionHistory(transaction_id=transaction_signature, user_public_key=user_public_key, nft_id=nft.nft_id)
+
+        try:
+            # Bulk insert skips unit-of-work bookkeeping; NFT goes first for the FK.
+            db.session.bulk_save_objects([nft, new_transaction])
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent request for the same signature won the insert.
+            db.session.rollback()
+            return jsonify({"success": False, "error": "Transaction already processed"}), 409
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({"success": False, "error": f"Database error: {str(e)}"}), 500
+
+        email_html = email_template.render(image=nft_data["image"])
+        # Fire-and-forget: the response does not depend on SMTP delivery.
+        send_email_async(user_public_key, "Your New NFT!", "See the attached NFT!", html=email_html)
+
+        return jsonify({"success": True, "message": "Payment verified, NFT generated and email queued!", "nft_data": nft_data})
+    else:
+        return jsonify({"success": False, "error": error_message}), 400
+
+
+# API Endpoint to Retrieve NFTs for a User
+@app.route("/get_nfts/<user_public_key>", methods=["GET"])
+def get_nfts(user_public_key):
+    """Retrieves all NFTs associated with a user's public key."""
+    # Select just the two columns so no NFT instances are hydrated.
+    rows = read_session.query(NFT.nft_id, NFT.metadata_url).filter_by(owner_public_key=user_public_key).all()
+    nft_data = [{"nft_id": nft_id, "metadata_url": metadata_url} for nft_id, metadata_url in rows]
+
+    # Let clients revalidate with If-None-Match and get an empty 304 back.
+    response = jsonify(nft_data)
+    response.set_etag(hashlib.sha256(response.get_data()).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = 30
+    return response.make_conditional(request)
+
+
+if __name__ == "__main__":
+    app.run(debug=True)
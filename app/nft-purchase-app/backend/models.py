@@ -1,13 +1,13 @@
 # backend/models.py
 from app import db
-from datetime import datetime
+from sqlalchemy import func
 
 class TransactionHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     transaction_id = db.Column(db.String(255), nullable=False, unique=True)
-    user_public_key = db.Column(db.String(255), nullable=False)
+    user_public_key = db.Column(db.String(255), nullable=False, index=True)
     nft_id = db.Column(db.String(255), db.ForeignKey('nft.nft_id'), nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime(timezone=True), default=func.now(), server_default=func.now(), nullable=False)
 
     def __repr__(self):
         return f'<Transaction {self.transaction_id}>'
@@ -16,6 +16,7 @@ class TransactionHistory(db.Model):
 class NFT(db.Model):
     nft_id = db.Column(db.String(255), primary_key=True)
     metadata_url = db.Column(db.String(255))
-    owner_public_key = db.Column(db.String(255), nullable=False)
+    owner_public_key = db.Column(db.String(255), nullable=False, index=True)
 
-    def __repr__
\ No newline at end of file
+    def __repr__(self):
+        return f'<NFT {self.nft_id}>'
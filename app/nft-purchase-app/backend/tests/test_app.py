@@ -0,0 +1,211 @@
+# backend/tests/test_app.py
+import os
+import pytest
+os.environ["DATABASE_URL"] = "sqlite:///:memory:"
+os.environ["CRAFT_TOKEN_MINT_ADDRESS"] = "CRAFTm1nt1111111111111111111111111111111111"
+os.environ["ADMIN_WALLET_PUBLIC_KEY"] = "9WzDXwBbmkg8ZTbNMqUxvQRAyrZzDsGYdVJ1CgMvHCJX"
+os.environ["NFT_PRICE_CRAFT"] = "1"
+
+from unittest.mock import patch
+from sqlalchemy import create_engine
+from backend import app as app_module
+from backend.app import verify_transaction
+
+USER = "7xKXtg2CW87d97TXJSDpbD5jBkheTqA83TZRuJosgAsU"
+ADMIN = os.environ["ADMIN_WALLET_PUBLIC_KEY"]
+CRAFT_MINT = os.environ["CRAFT_TOKEN_MINT_ADDRESS"]
+OTHER_MINT = "FakeM1nt11111111111111111111111111111111111"
+USER_ATA = "3Zs9QxFKhhZ1vCJXYMQsQ7gqE4yXyW2bNpfiGYLsUuTx"
+ADMIN_ATA = "5oVNBeEEQvYi1cX3ir8Dx5n1P7pdxydbGF2X4TxVusJm"
+TOKEN_PROGRAM = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+SIGNATURE = "5VERv8NMvzbJMEkV8xnrLkEaWRtSz9CosKDYjCJjBRnbJLgp8uirBgmQpjKhoR4tjF3ZpRzrFmBV6UjKdiSZkQUW"
+
+
+#Builds a getTransaction(encoding="jsonParsed") response for one SPL token transfer
+def _transaction_response(instruction, admin_ata_owner=ADMIN, mint=CRAFT_MINT):
+    return {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "result": {
+            "slot": 254112233,
+            "blockTime": 1700000000,
+            "meta": {
+                "err": None,
+                "fee": 5000,
+                "preTokenBalances": [],
+                "postTokenBalances": [
+                    {
+                        "accountIndex": 1,
+                        "mint": mint,
+                        "owner": USER,
+                        "programId": TOKEN_PROGRAM,
+                        "uiTokenAmount": {"amount": "9000000", "decimals": 6, "uiAmount": 9.0, "uiAmountString": "9"},
+                    },
+                    {
+                        "accountIndex": 2,
+                        "mint": mint,
+                        "owner": admin_ata_owner,
+                        "programId": TOKEN_PROGRAM,
+                        "uiTokenAmount": {"amount": "1000000", "decimals": 6, "uiAmount": 1.0, "uiAmountString": "1"},
+                    },
+                ],
+            },
+            "transaction": {
+                "signatures": [SIGNATURE],
+                "message": {
+                    "accountKeys": [
+                        {"pubkey": USER, "signer": True, "writable": True, "source": "transaction"},
+                        {"pubkey": USER_ATA, "signer": False, "writable": True, "source": "transaction"},
+                        {"pubkey": ADMIN_ATA, "signer": False, "writable": True, "source": "transaction"},
+                        {"pubkey": CRAFT_MINT, "signer": False, "writable": False, "source": "transaction"},
+                        {"pubkey": TOKEN_PROGRAM, "signer": False, "writable": False, "source": "transaction"},
+                    ],
+                    "instructions": [
+                        {"program": "spl-token", "programId": TOKEN_PROGRAM, "parsed": instruction, "stackHeight": None},
+                    ],
+                    "recentBlockhash": "EkSnNWid2cvwEVnVx9aBqawnmiCNiDgp3gUdkDPTKN1N",
+                },
+            },
+            "version": 0,
+        },
+    }
+
+
+def _transfer_checked(authority=USER, amount="1000000", mint=CRAFT_MINT):
+    return {
+        "type": "transferChecked",
+        "info": {
+            "source": USER_ATA,
+            "destination": ADMIN_ATA,
+            "mint": mint,
+            "authority": authority,
+            "tokenAmount": {"amount": amount, "decimals": 6, "uiAmount": int(amount) / 10**6, "uiAmountString": str(int(amount) / 10**6)},
+        },
+    }
+
+
+def _verify(response, amount=1.0):
+    with patch("backend.app.get_transaction", return_value=response):
+        return verify_transaction(SIGNATURE, USER, amount, CRAFT_MINT, ADMIN)
+
+
+#Source/destination are token accounts; the user is the authority and the admin owns the destination
+def test_verify_transaction_transfer_checked():
+    assert _verify(_transaction_response(_transfer_checked())) == (True, None)
+
+
+#Plain "transfer" has no mint or decimals; both come from postTokenBalances
+def test_verify_transaction_plain_transfer():
+    instruction = {
+        "type": "transfer",
+        "info": {"source": USER_ATA, "destination": ADMIN_ATA, "authority": USER, "amount": "1000000"},
+    }
+    assert _verify(_transaction_response(instruction)) == (True, None)
+
+
+def test_verify_transaction_rejects_other_authority():
+    is_valid, _ = _verify(_transaction_response(_transfer_checked(authority=ADMIN)))
+    assert not is_valid
+
+
+def test_verify_transaction_rejects_destination_not_owned_by_admin():
+    is_valid, _ = _verify(_transaction_response(_transfer_checked(), admin_ata_owner=USER))
+    assert not is_valid
+
+
+def test_verify_transaction_rejects_short_amount():
+    is_valid, _ = _verify(_transaction_response(_transfer_checked(amount="999999")))
+    assert not is_valid
+
+
+#A transfer of some other token into an admin-owned account is not a CRAFT payment
+def test_verify_transaction_rejects_other_mint():
+    is_valid, _ = _verify(_transaction_response(_transfer_checked(mint=OTHER_MINT), mint=OTHER_MINT))
+    assert not is_valid
+
+
+def test_verify_transaction_rejects_negative_amount():
+    is_valid, _ = _verify(_transaction_response(_transfer_checked(amount="1")), amount=-1)
+    assert not is_valid
+
+
+def _post_payment(signature, amount=1, mint=CRAFT_MINT):
+    client = app_module.app.test_client()
+    return client.post("/verify_payment", json={
+        "transactionSignature": signature,
+        "userPublicKey": USER,
+        "amount": amount,
+        "craftTokenMintAddress": mint,
+    })
+
+
+def _record_payment(signature, nft_id):
+    with app_module.app.app_context():
+        app_module.db.session.add(app_module.NFT(nft_id=nft_id, metadata_url="", owner_public_key=USER))
+        app_module.db.session.add(app_module.TransactionHistory(transaction_id=signature, user_public_key=USER, nft_id=nft_id))
+        app_module.db.session.commit()
+
+
+#A signature already on record is rejected before any RPC call
+@patch("backend.app.verify_transaction")
+@patch("backend.app.admin_keypair", object())
+def test_verify_payment_replay_probe(mock_verify):
+    _record_payment("replayed-signature", "replayed-nft")
+    response = _post_payment("replayed-signature")
+    assert response.status_code == 409
+    assert response.get_json()["error"] == "Transaction already processed"
+    mock_verify.assert_not_called()
+
+
+#A concurrent request that passed the probe loses on the unique index
+@patch("backend.app.send_email_async")
+@patch("backend.app.generate_nft", return_value={"nft_id": "raced-nft", "metadata_url": "", "image": ""})
+@patch("backend.app.verify_transaction", return_value=(True, None))
+@patch("backend.app.admin_keypair", object())
+def test_verify_payment_concurrent_replay(mock_verify, mock_generate_nft, mock_send_email):
+    _record_payment("raced-signature", "raced-nft")
+    with patch("backend.app.read_session") as mock_read_session:
+        mock_read_session.query.return_value.filter_by.return_value.first.return_value = None
+        response = _post_payment("raced-signature")
+    assert response.status_code == 409
+    assert response.get_json()["error"] == "Transaction already processed"
+    mock_send_email.assert_not_called()
+
+
+#The client's mint and amount must match the server configuration
+@patch("backend.app.verify_transaction")
+@patch("backend.app.admin_keypair", object())
+def test_verify_payment_rejects_other_mint(mock_verify):
+    response = _post_payment("other-mint-signature", mint=OTHER_MINT)
+    assert response.status_code == 400
+    mock_verify.assert_not_called()
+
+
+@pytest.mark.parametrize("amount", [1e-6, -1])
+@patch("backend.app.verify_transaction")
+@patch("backend.app.admin_keypair", object())
+def test_verify_payment_rejects_amount_below_price(mock_verify, amount):
+    response = _post_payment("cheap-signature", amount=amount)
+    assert response.status_code == 400
+    mock_verify.assert_not_called()
+
+
+#Verification runs against the configured mint and price
+@patch("backend.app.verify_transaction", return_value=(False, "Invalid transaction: No transfer to the recipient found."))
+@patch("backend.app.admin_keypair", object())
+def test_verify_payment_uses_server_price_and_mint(mock_verify):
+    response = _post_payment("priced-signature")
+    assert response.status_code == 400
+    mock_verify.assert_called_once_with("priced-signature", USER, app_module.NFT_PRICE_CRAFT, CRAFT_MINT, ADMIN)
+
+
+#Tables created before the server default existed still get a timestamp
+def test_transaction_timestamp_without_server_default():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE transaction_history (id INTEGER PRIMARY KEY, transaction_id VARCHAR(255) NOT NULL UNIQUE, "
+            "user_public_key VARCHAR(255) NOT NULL, nft_id VARCHAR(255) NOT NULL, timestamp DATETIME)"
+        )
+        conn.execute(app_module.TransactionHistory.__table__.insert(), {"transaction_id": "legacy-signature", "user_public_key": USER, "nft_id": "legacy-nft"})
+        assert conn.exec_driver_sql("SELECT timestamp FROM transaction_history").scalar() is not None
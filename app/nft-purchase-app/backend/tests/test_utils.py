@@ -1,20 +1,23 @@
 # backend/tests/test_utils.py
 import pytest
-from backend.utils import generate_svg, upload_to_ipfs, send_email
-import os
+from backend import utils
+from backend.utils import compute_ipfs_cid, generate_svg, upload_to_ipfs, send_email
+import smtplib
+import socket
+import threading
+import time
 
 def test_generate_svg():
-    svg_file = generate_svg("test_hash")
-    assert os.path.exists(svg_file)
-    os.remove(svg_file) #Clean up
+    svg = generate_svg(bytes.fromhex("0a141e2c3d4e5f"))
+    assert svg.startswith(b"<svg")
+    assert b"<circle cx='50' cy='100' r='3.75' fill='#2c3d4e'/>" in svg
 
 #Mocking IPFS for testing
 from unittest.mock import patch
-@patch("backend.utils.connect")
-def test_upload_to_ipfs(mock_connect):
-    mock_instance = mock_connect.return_value
-    mock_instance.add.return_value = {'Hash': 'test_cid'}
-    cid = upload_to_ipfs("dummy_file.txt")
+@patch("backend.utils._ipfs_http")
+def test_upload_to_ipfs(mock_http):
+    mock_http.post.return_value.text = '{"Name":"file","Hash":"test_cid","Size":"18"}\n'
+    cid = upload_to_ipfs(b"dummy data")
     assert cid == "test_cid"
 
 #Test Email Sending
@@ -24,4 +27,263 @@ def test_send_email():
     #You can extend it to check the return value based on successful/failed login
 
     result = send_email("test@example.com", "Test Subject", "Test Body")
-    assert result is False #Because email is not configured properly
\ No newline at end of file
+    assert result is False #Because email is not configured properly
+
+#Non-ASCII headers are RFC 2047-encoded and lines end in CRLF
+@patch("backend.utils._smtp_sendmail")
+@patch("backend.utils._EMAIL_ENABLED", True)
+def test_send_email_non_ascii_subject(mock_sendmail):
+    assert send_email("test@example.com", "Subj \u00e9", "Body") is True
+    message = mock_sendmail.call_args.args[1]
+    assert b"Subject: =?utf-8?q?Subj_=C3=A9?=\r\n" in message
+    assert b"\n" not in message.replace(b"\r\n", b"")
+
+#A failed login closes the socket it opened
+@patch("backend.utils._PipeliningSMTP")
+def test_smtp_login_failure_closes_connection(mock_smtp):
+    mock_smtp.return_value.login.side_effect = smtplib.SMTPAuthenticationError(535, b"bad credentials")
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        utils._smtp_sendmail("test@example.com", b"Subject: hi\r\n\r\nbody\r\n")
+    mock_smtp.return_value.close.assert_called_once()
+
+#Batched adds return one CID per file, in upload order
+@patch("backend.utils._ipfs_http")
+def test_add_to_ipfs_batch(mock_http):
+    mock_http.post.return_value.text = (
+        '{"Name":"image.svg","Hash":"image_cid","Size":"6"}\n'
+        '{"Name":"metadata.json","Hash":"meta_cid","Size":"2"}\n'
+    )
+    cids = utils._add_to_ipfs([("image.svg", b"<svg/>"), ("metadata.json", b"{}")])
+    assert cids == ["image_cid", "meta_cid"]
+    mock_http.post.assert_called_once()
+
+
+#Locally computed CID must match what `ipfs add --cid-version=1` returns
+def test_compute_ipfs_cid():
+    assert compute_ipfs_cid(b"") == "bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku"
+
+
+#Content already pinned by this process is not uploaded again
+@patch("backend.utils._ipfs_http")
+def test_upload_to_ipfs_skips_pinned_content(mock_http):
+    data = b"already pinned"
+    cid = compute_ipfs_cid(data)
+    mock_http.post.return_value.text = f'{{"Name":"file","Hash":"{cid}","Size":"14"}}\n'
+    assert upload_to_ipfs(data) == cid
+    assert upload_to_ipfs(data) == cid
+    mock_http.post.assert_called_once()
+
+
+#Already-pinned content completes without I/O; submitting it must not deadlock
+@patch("backend.utils._ipfs_http")
+def test_submit_upload_of_pinned_content(mock_http):
+    files = [("image.svg", b"<svg>pinned</svg>"), ("metadata.json", b'{"pinned":true}')]
+    for _, data in files:
+        utils._pinned_cids[compute_ipfs_cid(data)] = True
+
+    def submit_many():
+        for _ in range(200):
+            utils._submit_upload("pinned-key", files).result(timeout=5)
+
+    worker = threading.Thread(target=submit_many, daemon=True)
+    worker.start()
+    worker.join(timeout=10)
+    assert not worker.is_alive()
+    mock_http.post.assert_not_called()
+    # The last cleanup callback may still be running on the upload worker.
+    for _ in range(100):
+        with utils._pending_uploads_lock:
+            if "pinned-key" not in utils._pending_uploads:
+                break
+        time.sleep(0.01)
+    else:
+        pytest.fail("finished upload was never removed from _pending_uploads")
+
+
+def _wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+#Minting returns at once and both files end up pinned in the background
+@patch("backend.utils._post_to_ipfs", side_effect=lambda files: [compute_ipfs_cid(data) for _, data in files])
+def test_generate_nft_pins_in_background(mock_post):
+    metadata = utils.generate_nft("user-key")
+    metadata_cid = metadata["metadata_url"].rsplit("/", 1)[1]
+    assert _wait_for(lambda: metadata_cid in utils._pinned_cids)
+    mock_post.assert_called_once()
+    assert [name for name, _ in mock_post.call_args.args[0]] == ["image.svg", "metadata.json"]
+
+
+#A failing pin is retried on the scheduler thread until the attempt cap
+@patch("backend.utils.PIN_RETRY_DELAY_SECONDS", 0)
+@patch("backend.utils.PIN_RETRY_ATTEMPTS", 3)
+@patch("backend.utils._post_to_ipfs", return_value=None)
+def test_failed_pin_is_retried_then_dropped(mock_post):
+    files = [("image.svg", b"<svg>retry</svg>"), ("metadata.json", b'{"retry":true}')]
+    expected = [compute_ipfs_cid(data) for _, data in files]
+    utils._pin_in_background("retry-key", files, expected)
+    assert _wait_for(lambda: mock_post.call_count == 3)
+    time.sleep(0.1)
+    assert mock_post.call_count == 3
+    assert "retry-key" not in utils._pin_retry_keys
+
+
+#CIDs other than the ones handed out count as a failed pin
+@patch("backend.utils.PIN_RETRY_DELAY_SECONDS", 0)
+@patch("backend.utils.PIN_RETRY_ATTEMPTS", 2)
+@patch("backend.utils._post_to_ipfs", return_value=["other-image-cid", "other-metadata-cid"])
+def test_mismatched_pin_is_retried(mock_post):
+    files = [("image.svg", b"<svg>mismatch</svg>"), ("metadata.json", b'{"mismatch":true}')]
+    expected = [compute_ipfs_cid(data) for _, data in files]
+    utils._pin_in_background("mismatch-key", files, expected)
+    assert _wait_for(lambda: mock_post.call_count == 2)
+
+
+#Submissions sharing one failed upload queue a single retry
+@patch("backend.utils.PIN_RETRY_DELAY_SECONDS", 0.2)
+@patch("backend.utils.PIN_RETRY_ATTEMPTS", 2)
+def test_failed_pin_retried_once_per_key():
+    release = threading.Event()
+
+    def failing_post(files):
+        release.wait(timeout=5)
+        return None
+
+    files = [("image.svg", b"<svg>shared</svg>"), ("metadata.json", b'{"shared":true}')]
+    expected = [compute_ipfs_cid(data) for _, data in files]
+    with patch("backend.utils._post_to_ipfs", side_effect=failing_post) as mock_post:
+        utils._pin_in_background("shared-key", files, expected)
+        utils._pin_in_background("shared-key", files, expected)
+        release.set()
+        assert _wait_for(lambda: mock_post.call_count == 2)
+        time.sleep(0.4)
+        assert mock_post.call_count == 2
+
+
+#The add request forces the CID layout compute_ipfs_cid assumes
+@patch("backend.utils._ipfs_http")
+def test_add_to_ipfs_forces_cid_options(mock_http):
+    mock_http.post.return_value.text = '{"Name":"file","Hash":"test_cid","Size":"7"}\n'
+    upload_to_ipfs(b"options")
+    params = mock_http.post.call_args.kwargs["params"]
+    assert params["raw-leaves"] == "true"
+    assert params["hash"] == "sha2-256"
+    assert params["chunker"] == "size-262144"
+
+
+#Identical in-flight uploads share one Future and one request
+def test_submit_upload_single_flight():
+    release = threading.Event()
+    files = [("image.svg", b"<svg>single</svg>"), ("metadata.json", b'{"single":true}')]
+
+    def slow_post(files):
+        release.wait(timeout=5)
+        return [compute_ipfs_cid(data) for _, data in files]
+
+    with patch("backend.utils._post_to_ipfs", side_effect=slow_post) as mock_post:
+        first = utils._submit_upload("single-key", files)
+        second = utils._submit_upload("single-key", files)
+        release.set()
+        assert first is second
+        assert first.result(timeout=5) == [compute_ipfs_cid(data) for _, data in files]
+    mock_post.assert_called_once()
+
+
+#Minimal SMTP server advertising PIPELINING; handles one connection
+class _FakeSMTPServer:
+    def __init__(self, drop_after_refusal=False):
+        self.drop_after_refusal = drop_after_refusal
+        self.commands = []
+        self.messages = []
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        conn, _ = self.listener.accept()
+        with conn, conn.makefile("rb") as reader:
+            conn.sendall(b"220 fake ESMTP\r\n")
+            accepted = 0
+            for line in reader:
+                command = line.decode("ascii").rstrip("\r\n")
+                self.commands.append(command)
+                verb = command.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    conn.sendall(b"250-fake\r\n250-PIPELINING\r\n250 SIZE 1000000\r\n")
+                elif verb == "RCPT":
+                    if "refused" in command:
+                        conn.sendall(b"550 no such user\r\n")
+                    else:
+                        accepted += 1
+                        conn.sendall(b"250 ok\r\n")
+                elif verb == "DATA":
+                    if not accepted:
+                        conn.sendall(b"554 no valid recipients\r\n")
+                        if self.drop_after_refusal:
+                            return
+                        continue
+                    conn.sendall(b"354 go ahead\r\n")
+                    data = b""
+                    for data_line in reader:
+                        if data_line == b".\r\n":
+                            break
+                        data += data_line
+                    self.messages.append(data)
+                    conn.sendall(b"250 queued\r\n")
+                elif verb == "QUIT":
+                    conn.sendall(b"221 bye\r\n")
+                    return
+                else:
+                    conn.sendall(b"250 ok\r\n")
+        self.listener.close()
+
+
+class _PlainPipeliningSMTP(utils._PipeliningSMTP):
+    # Same client without TLS, so it can talk to the fake server.
+    def _get_socket(self, host, port, timeout):
+        return socket.create_connection((host, port), timeout)
+
+
+def _connect(server):
+    return _PlainPipeliningSMTP("127.0.0.1", server.port, timeout=5)
+
+
+#Envelope is pipelined and lines starting with "." are dot-stuffed
+def test_pipelining_sendmail_accepted():
+    server = _FakeSMTPServer()
+    client = _connect(server)
+    with patch.object(client, "send", wraps=client.send) as mock_send:
+        refused = client.sendmail("from@example.com", ["to@example.com"], b"Subject: hi\r\n\r\n.hidden\r\nbody\r\n")
+    # After EHLO, MAIL, RCPT and DATA leave in a single write
+    assert mock_send.call_args_list[1].args[0] == "mail FROM:<from@example.com> SIZE=30\r\nrcpt TO:<to@example.com>\r\ndata\r\n"
+    client.quit()
+    server.thread.join(timeout=5)
+    assert refused == {}
+    assert server.commands[1:4] == ["mail FROM:<from@example.com> SIZE=30", "rcpt TO:<to@example.com>", "data"]
+    assert server.messages == [b"Subject: hi\r\n\r\n..hidden\r\nbody\r\n"]
+
+
+#All recipients refused: the session is reset and stays usable
+def test_pipelining_sendmail_refused_recipient():
+    server = _FakeSMTPServer()
+    client = _connect(server)
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        client.sendmail("from@example.com", ["refused@example.com"], b"Subject: hi\r\n\r\nbody\r\n")
+    assert client.noop()[0] == 250
+    client.quit()
+    server.thread.join(timeout=5)
+    assert "rset" in server.commands
+
+
+#A server hanging up after the refusal must not mask the refusal
+def test_pipelining_sendmail_refused_then_disconnected():
+    server = _FakeSMTPServer(drop_after_refusal=True)
+    client = _connect(server)
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        client.sendmail("from@example.com", ["refused@example.com"], b"Subject: hi\r\n\r\nbody\r\n")
+    client.close()
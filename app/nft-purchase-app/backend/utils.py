@@ -1,63 +1,195 @@
 # nft-purchase-app/backend/utils.py
 import os
-import svgwrite
-import json
+import orjson
 import hashlib
-import secrets
 import time
 import base64
+import base58
+import functools
+import heapq
+import itertools
+import threading
+import queue
+import re
 from dotenv import load_dotenv
-from ipfshttpclient import connect
+import httpx
+from cachetools import LRUCache
 import smtplib
+import email.policy
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from email.mime.image import MIMEImage
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
 IPFS_GATEWAY_URL = os.getenv("IPFS_GATEWAY_URL")
+IPFS_API_URL = os.getenv("IPFS_API_URL", "http://127.0.0.1:5001")
 EMAIL_ADDRESS = os.getenv("EMAIL_ADDRESS")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
 
+# Derived once at import instead of on every mint/email.
+_EMAIL_ENABLED = bool(EMAIL_ADDRESS and EMAIL_PASSWORD)
+_GATEWAY_PREFIX = (IPFS_GATEWAY_URL or "").rstrip("/") + "/"
+
+class _EntropyBuffer:
+    # Hands out slices of one large os.urandom() read, so a burst of ids
+    # costs one getrandom() call per 16 KiB instead of one per id.
+    def __init__(self, size=16384):
+        self._size = size
+        self._buf = b""
+        self._lock = threading.Lock()
+
+    def take(self, n):
+        with self._lock:
+            if len(self._buf) < n:
+                self._buf = os.urandom(self._size)
+            out, self._buf = self._buf[:n], self._buf[n:]
+            return out
+
+    def reset(self):
+        self._buf = b""
+        self._lock = threading.Lock()
+
+_entropy = _EntropyBuffer()
+# A forked worker must not hand out the same bytes as its parent.
+os.register_at_fork(after_in_child=_entropy.reset)
+
 def generate_unique_id():
-    timestamp = str(int(time.time()))
-    random_token = secrets.token_hex(16)
-    combined_string = timestamp + random_token
-    unique_id = hashlib.sha256(combined_string.encode()).hexdigest()
-    return unique_id
-
-def generate_svg(unique_identifier):
-    dwg = svgwrite.Drawing("temp.svg", profile="tiny")
-    x = int(unique_identifier[:2], 16) * 5
-    y = int(unique_identifier[2:4], 16) * 5
-    radius = int(unique_identifier[4:6], 16) / 8
-    color = f"/{unique_identifier[6:12]}"
-
-    dwg.add(dwg.circle((x, y), radius, fill=color))
-    dwg.save()
-    return "temp.svg"
-
-def upload_to_ipfs(file_path):
-    try:
-        client = connect()
-        with open(file_path, "rb") as f:
-            response = client.add(f)
-            return response["Hash"]
-    except Exception as e:
-        print(f"Error uploading to IPFS: {e}")
-        return None
+    # 256 random bits are unique on their own; hashing them adds nothing.
+    return _entropy.take(32)
+
+def generate_svg(digest):
+    # Deterministic in the first 6 digest bytes: x, y and radius come from
+    # bytes 0-2 and the fill colour from bytes 3-5. Indexing bytes needs no
+    # hex parsing or shifting.
+    x = digest[0] * 5
+    y = digest[1] * 5
+    radius = digest[2] / 8
+    color = f"#{digest[3:6].hex()}"
+
+    # Minified single-line markup; the viewBox covers the full 0-1275 range
+    # of x and y and lets the image scale to its container.
+    svg = f"<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 1280 1280'><circle cx='{x}' cy='{y}' r='{radius:g}' fill='{color}'/></svg>"
+    return svg.encode("utf-8")
+
+IPFS_UPLOAD_ATTEMPTS = 3
+
+# One keep-alive HTTP client talks to the IPFS daemon's RPC API directly.
+# httpx.Client is thread-safe, so upload workers share its connection pool.
+_ipfs_http = httpx.Client(base_url=IPFS_API_URL, timeout=30)
+
+# Largest payload stored as a single raw block, i.e. whose CID
+# compute_ipfs_cid can derive without chunking.
+IPFS_CHUNK_SIZE = 256 * 1024
+
+# CIDs this process has pinned recently.
+_pinned_cids = LRUCache(maxsize=10_000)
+_pinned_cids_lock = threading.Lock()
+
+def compute_ipfs_cid(data):
+    # CIDv1 (raw codec, sha2-256) as produced by `ipfs add --cid-version=1`
+    # for content that fits in a single chunk (<= 256 KiB).
+    cid = bytes([0x01, 0x55, 0x12, 0x20]) + hashlib.sha256(data).digest()
+    return "b" + base64.b32encode(cid).decode("ascii").lower().rstrip("=")
 
-def generate_nft(user_public_key):
-    unique_id = generate_unique_id()
-    svg_file = generate_svg(unique_id)
+def _add_to_ipfs(files):
+    # Content whose locally computed CID is already known to be pinned is not
+    # uploaded again; only the remaining files are sent to the daemon.
+    local_cids = [compute_ipfs_cid(data) if len(data) <= IPFS_CHUNK_SIZE else None for _, data in files]
+    with _pinned_cids_lock:
+        missing = [i for i, cid in enumerate(local_cids) if cid is None or cid not in _pinned_cids]
+    if not missing:
+        return local_cids
 
-    image_cid = upload_to_ipfs(svg_file)
-    if image_cid is None:
+    uploaded = _post_to_ipfs([files[i] for i in missing])
+    if uploaded is None:
         return None
+    with _pinned_cids_lock:
+        for cid in uploaded:
+            _pinned_cids[cid] = True
+    cids = list(local_cids)
+    for i, cid in zip(missing, uploaded):
+        cids[i] = cid
+    return cids
+
+def _post_to_ipfs(files):
+    # All files go up in one multipart request. files is a list of
+    # (name, bytes) with unique names; /api/v0/add streams back one NDJSON
+    # entry per file, matched by name so extra entries cannot shift results.
+    for attempt in range(IPFS_UPLOAD_ATTEMPTS):
+        try:
+            response = _ipfs_http.post(
+                "/api/v0/add",
+                # Pinned to the layout compute_ipfs_cid assumes, whatever the
+                # daemon's Import.* defaults are.
+                params={
+                    "pin": "true",
+                    "cid-version": "1",
+                    "raw-leaves": "true",
+                    "hash": "sha2-256",
+                    "chunker": f"size-{IPFS_CHUNK_SIZE}",
+                    "wrap-with-directory": "false",
+                },
+                files=[("file", (name, data)) for name, data in files],
+            )
+            response.raise_for_status()
+            entries = [orjson.loads(line) for line in response.text.splitlines() if line]
+            cids = {entry["Name"]: entry["Hash"] for entry in entries}
+            return [cids[name] for name, _ in files]
+        except Exception as e:
+            print(f"Error uploading to IPFS (attempt {attempt + 1}): {e}")
+            if attempt + 1 < IPFS_UPLOAD_ATTEMPTS:
+                time.sleep(2 ** attempt)
+    return None
+
+# Uploads run on a shared pool. Identical in-flight uploads (e.g. a client
+# resubmitting the same payment before the first request finishes) share one
+# Future instead of pushing the same bytes to IPFS twice.
+_upload_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ipfs-upload")
+_pending_uploads = {}
+_pending_uploads_lock = threading.Lock()
+
+def _submit_upload(key, files):
+    with _pending_uploads_lock:
+        future = _pending_uploads.get(key)
+        created = future is None
+        if created:
+            future = _upload_pool.submit(_add_to_ipfs, files)
+            _pending_uploads[key] = future
+    # Attached outside the lock: on an already finished future the callback
+    # runs immediately in this thread and takes the lock itself.
+    if created:
+        future.add_done_callback(lambda f: _forget_upload(key, f))
+    return future
+
+def _forget_upload(key, future):
+    with _pending_uploads_lock:
+        if _pending_uploads.get(key) is future:
+            del _pending_uploads[key]
+
+def upload_to_ipfs(data):
+    cids = _add_to_ipfs([("file", data)])
+    return cids[0] if cids else None
+
+def generate_nft(user_public_key, tx_signature=None):
+    # An NFT minted for a payment takes its id from the transaction signature,
+    # which is already unique, so retries regenerate the same NFT.
+    if tx_signature:
+        digest = hashlib.sha256(base58.b58decode(tx_signature)).digest()
+    else:
+        digest = generate_unique_id()
+    unique_id = digest.hex()
+
+    # The image CID is computed locally so the metadata can reference it
+    # before upload, letting both files go to IPFS in a single request.
+    svg_bytes = generate_svg(digest)
+    image_cid = compute_ipfs_cid(svg_bytes)
 
     metadata = {
         "name": f"My Cool NFT - {unique_id[:8]}",
         "description": "A Unique NFT Generated for User",
-        "image": f"{IPFS_GATEWAY_URL}/{image_cid}",
+        "image": _GATEWAY_PREFIX + image_cid,
         "attributes": [
             {"trait_type": "Generated For", "value": user_public_key},
             {"trait_type": "Unique ID", "value": unique_id}
@@ -65,48 +197,242 @@ def generate_nft(user_public_key):
         "nft_id": unique_id
     }
 
-    metadata_json = json.dumps(metadata, indent=4).encode("utf-8")
+    # Compact: the metadata is machine-read, so indentation only adds bytes.
+    metadata_json = orjson.dumps(metadata)
 
-    metadata_cid = upload_to_ipfs(metadata_json)
-    if metadata_cid:
-        metadata["metadata_url"] = f"{IPFS_GATEWAY_URL}/{metadata_cid}"
-    else:
-        print("Warning: Could not upload metadata to IPFS")
+    metadata_cid = compute_ipfs_cid(metadata_json)
+    metadata["metadata_url"] = _GATEWAY_PREFIX + metadata_cid
 
-    os.remove(svg_file)
+    # Both CIDs are known locally, so pinning happens in the background and
+    # the caller does not wait on IPFS.
+    expected = [image_cid, metadata_cid]
+    _pin_in_background(metadata_cid, [("image.svg", svg_bytes), ("metadata.json", metadata_json)], expected)
 
     return metadata
 
-def send_email(recipient, subject, body, html=None, image_path=None):
-    if not EMAIL_ADDRESS or not EMAIL_PASSWORD:
+# A background pin that fails, or comes back with CIDs other than the ones
+# already handed out, is re-queued on a single scheduler thread with doubling
+# backoff and given up after PIN_RETRY_ATTEMPTS tries. At most one retry per
+# key is queued, however many submissions shared the failed upload.
+PIN_RETRY_ATTEMPTS = 6
+PIN_RETRY_DELAY_SECONDS = 30
+PIN_RETRY_MAX_DELAY_SECONDS = 600
+
+_pin_retries = []  # heap of (due, seq, key, files, expected, attempt)
+_pin_retry_keys = set()
+_pin_retry_seq = itertools.count()
+_pin_retry_cond = threading.Condition()
+
+def _pin_in_background(key, files, expected, attempt=0):
+    future = _submit_upload(key, files)
+    future.add_done_callback(lambda f: _check_pinned(f, key, files, expected, attempt))
+    return future
+
+def _check_pinned(future, key, files, expected, attempt):
+    cids = None if future.exception() else future.result()
+    if cids == expected:
+        return
+    if cids is None:
+        print(f"Warning: Could not pin {expected} to IPFS")
+    else:
+        print(f"Error: IPFS returned CIDs {cids}, expected {expected}")
+    if attempt + 1 >= PIN_RETRY_ATTEMPTS:
+        print(f"Error: Giving up pinning {expected} after {PIN_RETRY_ATTEMPTS} attempts")
+        return
+    _schedule_pin_retry(key, files, expected, attempt + 1)
+
+def _schedule_pin_retry(key, files, expected, attempt):
+    delay = min(PIN_RETRY_DELAY_SECONDS * 2 ** (attempt - 1), PIN_RETRY_MAX_DELAY_SECONDS)
+    with _pin_retry_cond:
+        if key in _pin_retry_keys:
+            return
+        _pin_retry_keys.add(key)
+        heapq.heappush(_pin_retries, (time.monotonic() + delay, next(_pin_retry_seq), key, files, expected, attempt))
+        _pin_retry_cond.notify()
+
+def _pin_retry_worker():
+    while True:
+        with _pin_retry_cond:
+            while not _pin_retries or _pin_retries[0][0] > time.monotonic():
+                _pin_retry_cond.wait(_pin_retries[0][0] - time.monotonic() if _pin_retries else None)
+            _, _, key, files, expected, attempt = heapq.heappop(_pin_retries)
+            _pin_retry_keys.discard(key)
+        _pin_in_background(key, files, expected, attempt)
+
+threading.Thread(target=_pin_retry_worker, name="ipfs-pin-retry", daemon=True).start()
+
+# A small pool of authenticated SMTP connections is kept open and reused, so
+# the TLS handshake and AUTH are paid once per connection, not per email.
+# Idle connections are checked with NOOP before reuse, and each connection
+# is retired after SMTP_MAX_MESSAGES sends.
+SMTP_POOL_SIZE = 4
+SMTP_MAX_MESSAGES = 100
+SMTP_IDLE_CHECK_SECONDS = 120
+# Bounds connect/read on a stalled server instead of the OS TCP default.
+SMTP_TIMEOUT_SECONDS = 15
+
+class _PipeliningSMTP(smtplib.SMTP_SSL):
+    # Sends MAIL FROM, RCPT TO and DATA back-to-back when the server
+    # advertises PIPELINING (RFC 2920), then reads the replies in order,
+    # so the envelope costs one round trip instead of one per command.
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=(), rcpt_options=()):
+        self.ehlo_or_helo_if_needed()
+        if not self.has_extn("pipelining") or mail_options or rcpt_options:
+            return super().sendmail(from_addr, to_addrs, msg, mail_options, rcpt_options)
+
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        if isinstance(msg, str):
+            msg = re.sub(r"(?:\r\n|\n|\r(?!\n))", "\r\n", msg).encode("ascii")
+        size = f" SIZE={len(msg)}" if self.has_extn("size") else ""
+
+        # One write for the whole envelope: separate putcmd() writes would be
+        # held back by Nagle until the server acknowledged MAIL FROM.
+        envelope = [f"mail FROM:{smtplib.quoteaddr(from_addr)}{size}\r\n"]
+        envelope += [f"rcpt TO:{smtplib.quoteaddr(addr)}\r\n" for addr in to_addrs]
+        envelope.append("data\r\n")
+        self.send("".join(envelope))
+
+        mail_reply = self.getreply()
+        refused = {}
+        for addr in to_addrs:
+            code, resp = self.getreply()
+            if code not in (250, 251):
+                refused[addr] = (code, resp)
+        data_code, data_resp = self.getreply()
+
+        if data_code == 354 and (mail_reply[0] != 250 or len(refused) == len(to_addrs)):
+            # The server accepted DATA anyway; end it with an empty message.
+            self.send(b".\r\n")
+            self.getreply()
+            data_code = None
+        if mail_reply[0] != 250:
+            self._rset()
+            raise smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], from_addr)
+        if len(refused) == len(to_addrs):
+            self._rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if data_code != 354:
+            self._rset()
+            raise smtplib.SMTPDataError(data_code, data_resp)
+
+        data = re.sub(rb"(?m)^\.", b"..", msg)
+        if not data.endswith(b"\r\n"):
+            data += b"\r\n"
+        self.send(data + b".\r\n")
+        code, resp = self.getreply()
+        if code != 250:
+            self._rset()
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+class _SMTPConnection:
+    def __init__(self):
+        self.server = _PipeliningSMTP("smtp.gmail.com", 465, timeout=SMTP_TIMEOUT_SECONDS)
+        try:
+            self.server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+        except Exception:
+            self.server.close()
+            raise
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def is_usable(self):
+        if self.sent >= SMTP_MAX_MESSAGES:
+            return False
+        if time.monotonic() - self.last_used < SMTP_IDLE_CHECK_SECONDS:
+            return True
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close(self):
+        try:
+            self.server.close()
+        except Exception:
+            pass
+
+# Slots start empty and are connected lazily on first use.
+_smtp_pool = queue.LifoQueue(maxsize=SMTP_POOL_SIZE)
+for _ in range(SMTP_POOL_SIZE):
+    _smtp_pool.put(None)
+
+def _smtp_sendmail(recipient, message):
+    conn = _smtp_pool.get()
+    try:
+        if conn is not None and not conn.is_usable():
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = _SMTPConnection()
+        try:
+            conn.server.sendmail(EMAIL_ADDRESS, recipient, message)
+        except smtplib.SMTPServerDisconnected:
+            conn.close()
+            conn = _SMTPConnection()
+            conn.server.sendmail(EMAIL_ADDRESS, recipient, message)
+        conn.sent += 1
+        conn.last_used = time.monotonic()
+    except Exception:
+        if conn is not None:
+            conn.close()
+            conn = None
+        raise
+    finally:
+        _smtp_pool.put(conn)
+
+# The plain-text body is the same for every purchase email, so its MIME part
+# is built once and attached to each message. Parts are only read during
+# serialization, so sharing them between messages is safe; copying a whole
+# prebuilt Message is not, since copy.copy shares its header and part lists.
+# The parts are built with compat32, whose headers only RFC 2047-encode
+# under compat32 itself; email.policy.SMTP fails on non-ASCII subjects.
+_SMTP_WIRE_POLICY = email.policy.compat32.clone(linesep="\r\n")
+
+@functools.lru_cache(maxsize=32)
+def _plain_text_part(body):
+    return MIMEText(body, "plain")
+
+def send_email(recipient, subject, body, html=None, image_data=None):
+    if not _EMAIL_ENABLED:
         print("Email credentials not set. Cannot send email.")
         return False
 
-    msg = MIMEMultipart("alternative")
+    body_part = MIMEMultipart("alternative")
+    body_part.attach(_plain_text_part(body))
+    if html:
+        body_part.attach(MIMEText(html, "html"))
+
+    # An image is sent as a related part that the HTML references via
+    # "cid:image1" (RFC 2387), rather than being inlined as a base64 data URI.
+    if image_data:
+        msg = MIMEMultipart("related")
+        msg.attach(body_part)
+        image_part = MIMEImage(image_data, _subtype="svg+xml")
+        image_part.add_header("Content-ID", "<image1>")
+        image_part.add_header("Content-Disposition", "inline", filename="nft.svg")
+        msg.attach(image_part)
+    else:
+        msg = body_part
     msg["From"] = EMAIL_ADDRESS
     msg["To"] = recipient
     msg["Subject"] = subject
 
-    msg.attach(MIMEText(body, "plain"))
-
-    if html:
-        if image_path:
-            try:
-                with open(image_path, "rb") as img_file:
-                    img_data = img_file.read()
-                    img_base64 = base64.b64encode(img_data).decode("utf-8")
-                    html = html.replace("cid:image1", f"data:image/svg+xml;base64,{img_base64}")
-            except Exception as e:
-                print(f"Error embedding image: {e}")
-
-        msg.attach(MIMEText(html, "html"))
-
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-            server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            server.sendmail(EMAIL_ADDRESS, recipient, msg.as_string())
+        # Serialize straight to CRLF wire-format bytes so sendmail skips its
+        # str -> ascii encode and line-ending rewrite.
+        _smtp_sendmail(recipient, msg.as_bytes(policy=_SMTP_WIRE_POLICY))
         print("Email sent successfully!")
         return True
     except Exception as e:
         print(f"Email sending failed: {e}")
-        return False
\ No newline at end of file
+        return False
+
+# Outgoing mail is handed to a background pool so request handlers never wait
+# on SMTP; callers get a Future for send_email's result and may ignore it.
+# One worker per pooled SMTP connection so the pool is actually used.
+_mail_pool = ThreadPoolExecutor(max_workers=SMTP_POOL_SIZE, thread_name_prefix="email")
+
+def send_email_async(recipient, subject, body, html=None, image_data=None):
+    return _mail_pool.submit(send_email, recipient, subject, body, html=html, image_data=image_data)